@@ -19,104 +19,32 @@ import argparse
 import os
 
 from migen import *
-from migen.genlib.resetsync import AsyncResetSynchronizer
 
-from litex_boards.platforms import icebreaker_bitsy
-
-from litex.soc.cores.ram import Up5kSPRAM
-from litex.soc.cores.spi_flash import SpiFlash
 from litex.soc.integration.soc_core import *
-from litex.soc.integration.soc import SoCRegion
 from litex.soc.integration.builder import *
+from litex.build.lattice.icestorm import icestorm_args, icestorm_argdict
 
-from no2migen.litex import NitroMuAcmUart
-
-kB = 1024
-mB = 1024*kB
-
-# CRG ----------------------------------------------------------------------------------------------
-
-class _CRG(Module):
-    def __init__(self, platform):
-        self.rst = Signal()
-        self.clock_domains.cd_sys    = ClockDomain()
-        self.clock_domains.cd_por    = ClockDomain(reset_less=True)
-        self.clock_domains.cd_usb_48 = ClockDomain()
-
-        # # #
-
-        # Clk/Rst
-        clk12 = platform.request("clk12")
-        rst_n = platform.request("user_btn_n")
-
-        # Power On Reset
-        por_count = Signal(16, reset=2**16-1)
-        por_done  = Signal()
-        self.comb += self.cd_por.clk.eq(ClockSignal())
-        self.comb += por_done.eq(por_count == 0)
-        self.sync.por += If(~por_done, por_count.eq(por_count - 1))
-
-        # PLL
-        pll_locked = Signal()
-
-        self.specials += Instance("SB_PLL40_2F_PAD",
-            p_DIVR                  = 0,
-            p_DIVF                  = 63,
-            p_DIVQ                  = 4,
-            p_FILTER_RANGE          = 1,
-            p_FEEDBACK_PATH         = "SIMPLE",
-            p_PLLOUT_SELECT_PORTA   = "GENCLK",
-            p_PLLOUT_SELECT_PORTB   = "GENCLK_HALF",
-            i_PACKAGEPIN            = clk12,
-            o_PLLOUTGLOBALA         = self.cd_usb_48.clk,
-            o_PLLOUTGLOBALB         = self.cd_sys.clk,
-            i_RESETB                = rst_n,
-            o_LOCK                  = pll_locked,
-        )
-
-        self.specials += [
-            AsyncResetSynchronizer(self.cd_sys,    ~por_done | ~pll_locked),
-            AsyncResetSynchronizer(self.cd_usb_48, ~por_done | ~pll_locked),
-        ]
-
-        platform.add_period_constraint(self.cd_sys.clk,    1e9/24e6)
-        platform.add_period_constraint(self.cd_usb_48.clk, 1e9/48e6)
-
+import _common
 
 # BaseSoC ------------------------------------------------------------------------------------------
 
-class BaseSoC(SoCCore):
-    mem_map = {**SoCCore.mem_map, **{"spiflash": 0x80000000}}
+class BaseSoC(_common.BaseSoC):
     def __init__(self, bios_flash_offset, revision="v1", **kwargs):
-        platform = icebreaker_bitsy.Platform(revision=revision)
-
-        # Disable Integrated ROM/SRAM since too large for iCE40 and UP5K has specific SPRAM.
-        kwargs["integrated_sram_size"] = 0
-        kwargs["integrated_rom_size"]  = 0
+        from litex_boards.platforms import icebreaker_bitsy
+        from no2migen.litex import NitroMuAcmUart
 
-        # Set CPU variant / reset address
-        kwargs["cpu_variant"] = "minimal"
-        kwargs["cpu_reset_address"] = self.mem_map["spiflash"] + bios_flash_offset
+        platform = icebreaker_bitsy.Platform(revision=revision)
 
         # Disable auto-uart add
         kwargs["with_uart"] = False
 
-        # SoCCore ----------------------------------------------------------------------------------
-        SoCCore.__init__(self, platform, int(24e6),
-            ident          = "LiteX SoC on iCEBreaker-bitsy",
-            ident_version  = True,
+        # Common base ------------------------------------------------------------------------------
+        _common.BaseSoC.__init__(self, platform, "clk12",
+            ident             = "LiteX SoC on iCEBreaker-bitsy",
+            bios_flash_offset = bios_flash_offset,
+            spi_flash         = dict(mode="4x", dummy_cycles=6), # Quad I/O fast read for XIP
             **kwargs)
 
-        # CRG --------------------------------------------------------------------------------------
-        self.submodules.crg = _CRG(platform)
-
-        # 128KB SPRAM (used as SRAM) ---------------------------------------------------------------
-        self.submodules.spram = Up5kSPRAM(size=128*kB)
-        self.bus.add_slave("sram", self.spram.bus, SoCRegion(size=128*kB))
-
-        # SPI Flash --------------------------------------------------------------------------------
-        self.add_spi_flash(mode="1x", dummy_cycles=8)
-
         # UART -------------------------------------------------------------------------------------
         usb_pads = self.platform.request("usb")
         self.submodules.uart = NitroMuAcmUart(platform, usb_pads, product="bitsy LiteX μACM")
@@ -132,13 +60,6 @@ class BaseSoC(SoCCore):
             i_S1   = 0,
         )
 
-        # Add ROM linker region --------------------------------------------------------------------
-        self.bus.add_region("rom", SoCRegion(
-            origin = self.mem_map["spiflash"] + bios_flash_offset,
-            size   = 32*kB,
-            linker = True)
-        )
-
 # Build --------------------------------------------------------------------------------------------
 
 def main():
@@ -149,6 +70,7 @@ def main():
     parser.add_argument("--revision",          default="v1",        help="Board revision 'v0' or 'v1'")
     builder_args(parser)
     soc_core_args(parser)
+    icestorm_args(parser)
     args = parser.parse_args()
 
     soc = BaseSoC(
@@ -157,7 +79,7 @@ def main():
         **soc_core_argdict(args)
     )
     builder = Builder(soc, **builder_argdict(args))
-    builder.build(run=args.build)
+    builder.build(**icestorm_argdict(args), run=args.build)
 
     if args.flash:
         from litex.build.dfu import DFUProg
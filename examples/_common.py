@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2019 Sean Cross <sean@xobs.io>
+# Copyright (c) 2018 David Shah <dave@ds0.me>
+# Copyright (c) 2020 Piotr Esden-Tempski <piotr@esden.net>
+# Copyright (c) 2020 Florent Kermarrec <florent@enjoy-digital.fr>
+# Copyright (c) 2021 Sylvain Munaut <tnt@246tNt.com>
+# SPDX-License-Identifier: BSD-2-Clause
+
+# CRG and base SoC shared by all the iCE40 UP5K LiteX examples.
+#
+# The board specific example scripts only select the platform, the clock
+# input and add whatever USB core they are demonstrating on top.
+
+from migen import *
+from migen.genlib.cdc import MultiReg
+from migen.genlib.resetsync import AsyncResetSynchronizer
+
+from litex.soc.integration.soc_core import *
+from litex.soc.integration.soc import SoCRegion
+
+kB = 1024
+mB = 1024*kB
+
+# PLL ----------------------------------------------------------------------------------------------
+
+def ice40_pll_params(f_ref, f_out):
+    """Computes the SB_PLL40 divider parameters (for SIMPLE feedback) giving
+    the closest achievable frequency to 'f_out' from a 'f_ref' reference"""
+    best = None
+
+    for divr in range(16):
+        f_pfd = f_ref / (divr + 1)
+        if not (10e6 <= f_pfd <= 133e6):
+            continue
+
+        for divf in range(128):
+            f_vco = f_pfd * (divf + 1)
+            if not (533e6 <= f_vco <= 1066e6):
+                continue
+
+            for divq in range(1, 7):
+                err = abs(f_vco / 2**divq - f_out)
+                if (best is None) or (err < best[0]):
+                    best = (err, divr, divf, divq, f_pfd)
+
+    if best is None:
+        raise ValueError(f"No valid PLL configuration for {f_ref/1e6:g} MHz reference")
+
+    err, divr, divf, divq, f_pfd = best
+
+    # Loop filter setting depends on the PFD frequency
+    filter_range = 1 + sum(f_pfd >= f for f in [17e6, 26e6, 44e6, 66e6, 101e6])
+
+    return dict(
+        p_DIVR                  = divr,
+        p_DIVF                  = divf,
+        p_DIVQ                  = divq,
+        p_FILTER_RANGE          = filter_range,
+    )
+
+# CRG ----------------------------------------------------------------------------------------------
+
+class _CRG(Module):
+    def __init__(self, platform, clk, reset_kind="async", reset_pipeline=2):
+        self.rst = Signal()
+        self.clock_domains.cd_sys    = ClockDomain()
+        self.clock_domains.cd_por    = ClockDomain(reset_less=True)
+        self.clock_domains.cd_usb_48 = ClockDomain()
+
+        # # #
+
+        # Power On Reset
+        #  Count down 256 cycles (~10 us at 24 MHz, plenty for the BRAMs to
+        #  be usable after configuration) and use the underflow into the
+        #  extra MSB as 'done' flag so that no wide comparator is needed.
+        por_count = Signal(9, reset=2**8-1)
+        por_done  = Signal()
+        self.comb += self.cd_por.clk.eq(ClockSignal())
+        self.comb += por_done.eq(por_count[8])
+        self.sync.por += If(~por_done, por_count.eq(por_count - 1))
+
+        # PLL
+        pll_locked = Signal()
+
+        if clk == "clk12":
+            # 12 MHz crystal on a PLL capable pad, user button as reset
+            pll_prim = "SB_PLL40_2F_PAD"
+            pll_ref  = 12e6
+            pll_io   = dict(
+                i_PACKAGEPIN            = platform.request("clk12"),
+                i_RESETB                = platform.request("user_btn_n"),
+            )
+
+        elif clk == "clk48":
+            # 48 MHz oscillator routed through the fabric
+            pll_prim = "SB_PLL40_2F_CORE"
+            pll_ref  = 48e6
+            pll_io   = dict(
+                i_REFERENCECLK          = platform.request("clk48"),
+                i_RESETB                = 1,
+            )
+
+        else:
+            raise ValueError(f"Unsupported clock input '{clk}'")
+
+        self.specials += Instance(pll_prim,
+            **ice40_pll_params(pll_ref, 48e6),
+            p_FEEDBACK_PATH         = "SIMPLE",
+            p_PLLOUT_SELECT_PORTA   = "GENCLK",
+            p_PLLOUT_SELECT_PORTB   = "GENCLK_HALF",
+            o_PLLOUTGLOBALA         = self.cd_usb_48.clk,
+            o_PLLOUTGLOBALB         = self.cd_sys.clk,
+            o_LOCK                  = pll_locked,
+            **pll_io
+        )
+
+        # Resets
+        if reset_kind == "async":
+            self.specials += [
+                AsyncResetSynchronizer(self.cd_sys,    ~por_done | ~pll_locked),
+                AsyncResetSynchronizer(self.cd_usb_48, ~por_done | ~pll_locked),
+            ]
+
+        elif reset_kind == "sync":
+            # Synchronize the reset request in each domain and then go
+            # through a few more registers so the tools can replicate /
+            # retime them to deal with the reset fanout
+            for cd in [self.cd_sys, self.cd_usb_48]:
+                rst = Signal()
+                self.specials += MultiReg(~por_done | ~pll_locked, rst, odomain=cd.name, reset=1)
+
+                sd = getattr(self.sync, cd.name)
+                for i in range(reset_pipeline):
+                    rst_d = Signal(reset=1, reset_less=True)
+                    sd += rst_d.eq(rst)
+                    rst = rst_d
+
+                self.comb += cd.rst.eq(rst)
+
+        else:
+            raise ValueError(f"Unsupported reset kind '{reset_kind}'")
+
+        platform.add_period_constraint(self.cd_sys.clk,    1e9/24e6)
+        platform.add_period_constraint(self.cd_usb_48.clk, 1e9/48e6)
+
+# BaseSoC ------------------------------------------------------------------------------------------
+
+class BaseSoC(SoCCore):
+    mem_map = {**SoCCore.mem_map, **{"spiflash": 0x80000000}}
+    def __init__(self, platform, clk, ident, bios_flash_offset, reset_kind="async", spi_flash=None, **kwargs):
+        # Only needed to actually build the SoC, not to parse arguments. The board scripts defer
+        # their platform / core imports the same way so --help works without the full toolchain.
+        from litex.soc.cores.ram import Up5kSPRAM
+
+        # Disable Integrated ROM/SRAM since too large for iCE40 and UP5K has specific SPRAM.
+        kwargs["integrated_sram_size"] = 0
+        kwargs["integrated_rom_size"]  = 0
+
+        # Set CPU variant / reset address
+        kwargs["cpu_variant"] = "minimal"
+        kwargs["cpu_reset_address"] = self.mem_map["spiflash"] + bios_flash_offset
+
+        # SoCCore ----------------------------------------------------------------------------------
+        SoCCore.__init__(self, platform, int(24e6),
+            ident          = ident,
+            ident_version  = True,
+            **kwargs)
+
+        # CRG --------------------------------------------------------------------------------------
+        self.submodules.crg = _CRG(platform, clk, reset_kind)
+
+        # 128KB SPRAM (used as SRAM) ---------------------------------------------------------------
+        self.submodules.spram = Up5kSPRAM(size=128*kB)
+        self.bus.add_slave("sram", self.spram.bus, SoCRegion(size=128*kB))
+
+        # SPI Flash --------------------------------------------------------------------------------
+        # Options are passed as-is so each board can tune them to its flash chip (mode and dummy
+        # cycles with the legacy SpiFlash core, or module / clk_freq / rate with LiteSPI).
+        self.add_spi_flash(**(spi_flash or dict(mode="1x", dummy_cycles=8)))
+
+        # Add ROM linker region --------------------------------------------------------------------
+        self.bus.add_region("rom", SoCRegion(
+            origin = self.mem_map["spiflash"] + bios_flash_offset,
+            size   = 32*kB,
+            linker = True)
+        )
@@ -21,10 +21,13 @@ class LoopbackTest(Module):
         rst_n = platform.request("user_btn_n")
 
         # Power On Reset
-        por_count = Signal(16, reset=2**16-1)
+        #  Count down 256 cycles (~10 us at 24 MHz, plenty for the BRAMs to
+        #  be usable after configuration) and use the underflow into the
+        #  extra MSB as 'done' flag so that no wide comparator is needed.
+        por_count = Signal(9, reset=2**8-1)
         por_done  = Signal()
         self.comb += self.cd_por.clk.eq(ClockSignal())
-        self.comb += por_done.eq(por_count == 0)
+        self.comb += por_done.eq(por_count[8])
         self.sync.por += If(~por_done, por_count.eq(por_count - 1))
 
         # PLL
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+#
+# Customization of the no2muacm IP, shared by the Migen and LiteX wrappers
+#
+# Copyright (C) 2021  Sylvain Munaut <tnt@246tNt.com>
+# SPDX-License-Identifier: CERN-OHL-P-2.0
+#
+
+import functools
+import hashlib
+import os
+import tempfile
+
+from ._resources import lazy_import, resource_path
+
+
+# Customization options, in the order expected by _build_muacm_ip
+OPTIONS = ('vid', 'pid', 'vendor', 'product', 'serial', 'no_dfu_rt', 'build_dir')
+
+# Generated IP files. Those need to stay around until the build is done
+# so keep a reference for the whole process lifetime.
+_ip_files = []
+
+
+@functools.lru_cache(maxsize=None)
+def _build_muacm_ip(vid, pid, vendor, product, serial, no_dfu_rt, build_dir):
+	# Load the customizer and the source
+	no2muacm_customize = lazy_import('no2muacm_customize', 'cores/no2muacm-bin/muacm_customize.py')
+
+	sf = no2muacm_customize.MuAcmPatcher()
+	sf.load(resource_path('cores/no2muacm-bin/muacm.v'))
+
+	# Apply requested customization
+	if vid is not None:
+		sf.set_vid(vid)
+
+	if pid is not None:
+		sf.set_pid(pid)
+
+	if vendor is not None:
+		sf.set_vendor(vendor)
+
+	if product is not None:
+		sf.set_product(product)
+
+	if serial is not None:
+		sf.set_serial(serial)
+
+	if no_dfu_rt:
+		sf.disable_dfu_rt()
+
+	# Save to the build directory if we have one, else to a temporary file
+	if build_dir is not None:
+		# Name depends on the options so different customizations can't
+		# overwrite each other
+		tag = hashlib.sha1(repr((vid, pid, vendor, product, serial, no_dfu_rt)).encode()).hexdigest()[:8]
+
+		os.makedirs(build_dir, exist_ok=True)
+		ip_file_name = os.path.join(build_dir, f'muacm_custom_{tag}.v')
+
+	else:
+		ip_file = tempfile.NamedTemporaryFile(suffix='.v')
+		_ip_files.append(ip_file)
+
+		ip_file_name = os.path.abspath(ip_file.name)
+
+	sf.save(ip_file_name)
+
+	return ip_file_name
+
+
+def gen_customized_ip(**kwargs):
+	"""Returns the path to a no2muacm IP file customized with the given
+	options. Identical customizations are only generated once per process.
+
+	The file is written to 'build_dir' if given, else to a temporary file
+	that lives as long as the process."""
+	# Normalize the options so equivalent calls share the same cache entry
+	# whatever the order / form in which they were passed
+	opts = dict((k, kwargs.get(k)) for k in OPTIONS)
+
+	opts['no_dfu_rt'] = bool(opts['no_dfu_rt'])
+
+	if opts['build_dir'] is not None:
+		opts['build_dir'] = os.path.abspath(opts['build_dir'])
+
+	return _build_muacm_ip(*(opts[k] for k in OPTIONS))
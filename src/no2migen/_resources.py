@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+#
+# Access to the resources (RTL, helper scripts) of the bundled cores
+#
+# Copyright (C) 2021  Sylvain Munaut <tnt@246tNt.com>
+# SPDX-License-Identifier: CERN-OHL-P-2.0
+#
+
+import functools
+import importlib.util
+
+try:
+	# Python 3.9+, much lighter than pkg_resources
+	from importlib.resources import files as _pkg_files
+except ImportError:
+	_pkg_files = None
+
+
+# Helper scripts already loaded, by name
+_MODS = {}
+
+
+@functools.lru_cache(maxsize=None)
+def resource_path(rel_path):
+	"""Returns the filesystem path of a resource of the package. Those are
+	static for a given install so the lookup is only done once."""
+	if _pkg_files is not None:
+		return str(_pkg_files('no2migen') / rel_path)
+
+	import pkg_resources
+	return pkg_resources.resource_filename('no2migen', rel_path)
+
+
+@functools.lru_cache(maxsize=None)
+def resource_sources(rel_path, ext='.v'):
+	"""Returns the (sorted) tuple of files with extension 'ext' in the
+	resource directory 'rel_path'"""
+	if _pkg_files is not None:
+		names = [f.name for f in (_pkg_files('no2migen') / rel_path).iterdir()]
+	else:
+		import pkg_resources
+		names = pkg_resources.resource_listdir('no2migen', rel_path)
+
+	return tuple(sorted(f for f in names if f.endswith(ext)))
+
+
+def lazy_import(name, rel_path):
+	"""Loads the python file at 'rel_path' (relative to the package) as
+	module 'no2migen.<name>'. Each file is only executed once per process."""
+	mod = _MODS.get(name)
+
+	if mod is None:
+		mod_spec = importlib.util.spec_from_file_location(
+			'no2migen.' + name,
+			resource_path(rel_path)
+		)
+		mod = importlib.util.module_from_spec(mod_spec)
+		mod_spec.loader.exec_module(mod)
+		_MODS[name] = mod
+
+	return mod
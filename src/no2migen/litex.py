@@ -7,22 +7,41 @@
 # SPDX-License-Identifier: CERN-OHL-P-2.0
 #
 
-import importlib
-import math
+import functools
 import os
-import pkg_resources
-import tempfile
 
 from migen import *
 from migen.genlib.cdc import MultiReg, PulseSynchronizer
+from migen.genlib.fifo import AsyncFIFO
 
 from litex.soc.cores.uart import UART
 from litex.soc.interconnect import stream, wishbone
 
+from . import _muacm
+from ._resources import lazy_import, resource_path, resource_sources
+
 
 __all__ = [ 'NitroUSB', 'NitroMuAcmUart' ]
 
 
+@functools.lru_cache(maxsize=None)
+def _assemble_microcode():
+	# Load the microcode compiler as module
+	no2usb_microcode = lazy_import('no2usb_microcode', 'cores/no2usb/utils/microcode.py')
+
+	# Assemble microcode and return it (as a tuple since it's shared)
+	return tuple(no2usb_microcode.assemble(no2usb_microcode.mc)[0])
+
+
+@functools.lru_cache(maxsize=None)
+def _microcode_hex():
+	# Content of the microcode file, as written to the gateware directory.
+	# Formatted in a single operation with a format string sized to the
+	# microcode length.
+	mc = _assemble_microcode()
+	return (('%04x\n' * len(mc)) % mc).encode()
+
+
 
 class NitroUSB(Module):
 	"""Wrapper for the Nitro FPGA USB Core
@@ -32,12 +51,22 @@ class NitroUSB(Module):
 	If both domains are identical, some CDC logic can be simplified and the
 	'sync' argument should be set to True when creating the core.
 
+	When the domains are different, each access to the core registers has to
+	go through a full handshake across domains. Setting 'posted_writes' to
+	True allows writes to be acknowledged immediately and completed in the
+	background, only stalling the next register access until it's done.
+
 	Attributes
     ----------
 
 	bus : wishbone.Interface(width)
 		Wishbone interface to both the CSRs and the EP buffers
 
+	bus_csr : wishbone.Interface(width)
+	bus_ep  : wishbone.Interface(width)
+		Separate Wishbone interfaces for the CSRs and the EP buffers,
+		replacing 'bus' when created with split_bus=True
+
 	irq : Signal(), out
 		IRQ level output to the CPU (assuming IRQ are enabled in the core)
 
@@ -45,16 +74,25 @@ class NitroUSB(Module):
 		Start-of-Frame pulse emitted every time a SoF packet is received
 	"""
 
-	def __init__(self, platform, pads, width=32, evt_fifo=False, irq=False, sync=False):
+	def __init__(self, platform, pads, width=32, evt_fifo=False, irq=False, sync=False,
+		posted_writes=False, split_bus=False, registered_decode=False):
+
+		# The core registers are 16 bits so the bus can't be narrower
+		assert width in (16, 32, 64), "Unsupported bus width"
 
 		# Exposed signals
-		self.bus = wishbone.Interface(width)
+		if split_bus:
+			self.bus_csr = bus_core = wishbone.Interface(width)
+			self.bus_ep  = bus_ep   = wishbone.Interface(width)
+		else:
+			self.bus = bus_core = bus_ep = wishbone.Interface(width)
+
 		self.irq = Signal()
 		self.sof = Signal()
 
 		# Internal signals
 		b_rdata_ep   = Signal(width)
-		b_rdata_core = Signal(width)
+		b_rdata_core = Signal(16)
 		b_cyc_ep     = Signal()
 		b_cyc_core   = Signal()
 		b_ack_ep     = Signal()
@@ -75,11 +113,11 @@ class NitroUSB(Module):
 			# Just wires
 			self.comb += [
 				# Bus
-				ub_addr.eq(self.bus.adr[0:12]),
-				ub_wdata.eq(self.bus.dat_w[0:16]),
-				ub_we.eq(self.bus.we),
+				ub_addr.eq(bus_core.adr[0:12]),
+				ub_wdata.eq(bus_core.dat_w[0:16]),
+				ub_we.eq(bus_core.we),
 				ub_cyc.eq(b_cyc_core),
-				b_rdata_core[0:16].eq(ub_rdata),
+				b_rdata_core.eq(ub_rdata),
 				b_ack_core.eq(ub_ack),
 
 				# Aux
@@ -90,45 +128,87 @@ class NitroUSB(Module):
 		else:
 			# Cross-clock domain
 				# Wishbone
-					# Those are stable for some time until the handshake signal
-					# cross the to the other domain so we can use them as-is in 'usb_48'
-			self.comb += [
-				ub_addr.eq(self.bus.adr[0:12]),
-				ub_wdata.eq(self.bus.dat_w[0:16]),
-				ub_we.eq(self.bus.we),
-			]
-
-					# Still need to capture during ack though but it'll be
-					# stable long enough to be used in 'sys'
-			self.sync.usb_48 += If(ub_ack, b_rdata_core[0:16].eq(ub_rdata))
-
-					# Handshake is more complex
+					# Requests only need a pulse, responses go through a small
+					# async FIFO that carries the read data along with the ack
 			ps_req = PulseSynchronizer("sys", "usb_48")
-			ps_ack = PulseSynchronizer("usb_48", "sys")
-			self.submodules += [ ps_req, ps_ack ]
+			self.submodules += ps_req
 
-			hs_cyc   = Signal()
-			hs_cyc_d = Signal()
-			hs_ack   = Signal()
-			hs_ack_d = Signal()
+			rsp_fifo = ClockDomainsRenamer({"write": "usb_48", "read": "sys"})(AsyncFIFO(16, 2))
+			self.submodules += rsp_fifo
 
-			self.sync.sys += [
-				hs_cyc_d.eq(hs_cyc),
-				hs_ack_d.eq(hs_ack),
-			]
+			rsp_ack = Signal()
 
 			self.sync.usb_48 += [
 				ub_cyc.eq((ub_cyc | ps_req.o) & ~ub_ack),
 			]
 
 			self.comb += [
-				hs_cyc.eq(b_cyc_core),
-				ps_req.i.eq(hs_cyc & (~hs_cyc_d | hs_ack_d)),
-				ps_ack.i.eq(ub_ack),
-				hs_ack.eq(ps_ack.o),
-				b_ack_core.eq(hs_ack),
+				rsp_fifo.din.eq(ub_rdata),
+				rsp_fifo.we.eq(ub_ack),
+				rsp_fifo.re.eq(rsp_fifo.readable),
+				rsp_ack.eq(rsp_fifo.readable),
+				b_rdata_core.eq(rsp_fifo.dout),
 			]
 
+			if posted_writes:
+					# Latch the access and ack writes right away. The write
+					# then completes in the background and only the next
+					# access needs to wait for it.
+				pw_addr  = Signal(12)
+				pw_wdata = Signal(16)
+				pw_we    = Signal()
+				pw_busy  = Signal()
+				pw_post  = Signal()
+				pw_issue = Signal()
+
+				self.sync.sys += [
+					If(pw_issue,
+						pw_addr.eq(bus_core.adr[0:12]),
+						pw_wdata.eq(bus_core.dat_w[0:16]),
+						pw_we.eq(bus_core.we),
+						pw_post.eq(bus_core.we),
+						pw_busy.eq(1),
+					).Elif(rsp_ack,
+						pw_busy.eq(0),
+					)
+				]
+
+				self.comb += [
+					ub_addr.eq(pw_addr),
+					ub_wdata.eq(pw_wdata),
+					ub_we.eq(pw_we),
+					pw_issue.eq(b_cyc_core & ~pw_busy),
+					ps_req.i.eq(pw_issue),
+					b_ack_core.eq((pw_issue & bus_core.we) | (rsp_ack & ~pw_post)),
+				]
+
+			else:
+					# Those are stable for some time until the handshake signal
+					# cross the to the other domain so we can use them as-is in 'usb_48'
+				self.comb += [
+					ub_addr.eq(bus_core.adr[0:12]),
+					ub_wdata.eq(bus_core.dat_w[0:16]),
+					ub_we.eq(bus_core.we),
+				]
+
+					# Handshake is more complex
+				hs_cyc   = Signal()
+				hs_cyc_d = Signal()
+				hs_ack   = Signal()
+				hs_ack_d = Signal()
+
+				self.sync.sys += [
+					hs_cyc_d.eq(hs_cyc),
+					hs_ack_d.eq(hs_ack),
+				]
+
+				self.comb += [
+					hs_cyc.eq(b_cyc_core),
+					ps_req.i.eq(hs_cyc & (~hs_cyc_d | hs_ack_d)),
+					hs_ack.eq(rsp_ack),
+					b_ack_core.eq(hs_ack),
+				]
+
 				# IRQ
 			self.specials += MultiReg(u_irq, self.irq)
 
@@ -141,48 +221,45 @@ class NitroUSB(Module):
 			]
 
 		# EP interface
-		EPAW = 11 - int(math.log2(width / 8))
-
-		ep_tx_addr_0 = Signal(EPAW)
-		ep_tx_data_0 = Signal(width)
-		ep_tx_we_0   = Signal()
-		ep_rx_addr_0 = Signal(EPAW)
-		ep_rx_data_1 = Signal(width)
-
-		self.comb += [
-			ep_tx_addr_0.eq(self.bus.adr[0:EPAW]),
-			ep_tx_data_0.eq(self.bus.dat_w),
-			ep_tx_we_0.eq(b_ack_ep & self.bus.we),
-			ep_rx_addr_0.eq(self.bus.adr[0:EPAW]),
-			b_rdata_ep.eq(ep_rx_data_1),
-		]
+			# The EP buffers themselves are inside the core, we only need to
+			# provide an address (shared by the TX and RX buffers since the
+			# CPU only ever accesses one at a time) and the write data, all
+			# wired straight from the bus to the instance below
+		EPAW = 11 - {16: 1, 32: 2, 64: 3}[width]
 
 		self.sync.sys += [
 			b_ack_ep.eq(b_cyc_ep & ~b_ack_ep),
 		]
 
 		# USB Core instance
-			# Add required sources
-		no2usb_path  = pkg_resources.resource_filename('no2migen', 'cores/no2usb/rtl/')
-		no2usb_files = pkg_resources.resource_listdir('no2migen', 'cores/no2usb/rtl/')
-		no2usb_srcs  = [f for f in no2usb_files if f.endswith('.v')]
+			# Add required sources. The platform already ignores duplicate
+			# sources but LiteX keeps the include paths in a plain list.
+		no2usb_path = resource_path('cores/no2usb/rtl/')
+		no2usb_srcs = resource_sources('cores/no2usb/rtl/')
 
-		platform.add_verilog_include_path(no2usb_path)
+		if os.path.abspath(no2usb_path) not in platform.verilog_include_paths:
+			platform.add_verilog_include_path(no2usb_path)
 		platform.add_sources(no2usb_path, *no2usb_srcs)
 
 			# Instanciate
-		self.specials += Instance("usb",
+		usb_cd = "sys" if sync else "usb_48"
+
+		usb_params = dict(
 			p_EPDW          = width,
 			p_EVT_DEPTH     = 4 if (evt_fifo is True) else 0,
-			p_IRQ           = int(irq),
+			p_IRQ           = int(bool(irq)),
+		)
+
+		self.specials += Instance("usb",
+			**usb_params,
 			io_pad_dp       = pads.d_p,
 			io_pad_dn       = pads.d_n,
 			o_pad_pu        = pads.pullup,
-			i_ep_tx_addr_0  = ep_tx_addr_0,
-			i_ep_tx_data_0  = ep_tx_data_0,
-			i_ep_tx_we_0    = ep_tx_we_0,
-			i_ep_rx_addr_0  = ep_rx_addr_0,
-			o_ep_rx_data_1  = ep_rx_data_1,
+			i_ep_tx_addr_0  = bus_ep.adr[0:EPAW],
+			i_ep_tx_data_0  = bus_ep.dat_w,
+			i_ep_tx_we_0    = b_ack_ep & bus_ep.we,
+			i_ep_rx_addr_0  = bus_ep.adr[0:EPAW],
+			o_ep_rx_data_1  = b_rdata_ep,
 			i_ep_rx_re_0    = b_cyc_ep,
 			i_ep_clk        = ClockSignal("sys"),
 			i_wb_addr       = ub_addr,
@@ -193,38 +270,78 @@ class NitroUSB(Module):
 			o_wb_ack        = ub_ack,
 			o_irq           = u_irq,
 			o_sof           = u_sof,
-			i_clk           = ClockSignal("sys" if sync else "usb_48"),
-			i_rst           = ResetSignal("sys" if sync else "usb_48"),
+			i_clk           = ClockSignal(usb_cd),
+			i_rst           = ResetSignal(usb_cd),
 		)
 
 		# Bus muxing
-		self.comb += [
-			b_cyc_ep.eq(self.bus.cyc & self.bus.stb & self.bus.adr[13]),
-			b_cyc_core.eq(self.bus.cyc & self.bus.stb & ~self.bus.adr[13]),
-			self.bus.ack.eq(b_ack_core | b_ack_ep),
-			self.bus.dat_r.eq(Mux(b_ack_ep, b_rdata_ep, b_rdata_core)),
-		]
+			# Decode
+		if split_bus:
+			cyc_ep   = bus_ep.cyc & bus_ep.stb
+			cyc_core = bus_core.cyc & bus_core.stb
+		else:
+			bus_cyc  = self.bus.cyc & self.bus.stb
+			sel_ep   = self.bus.adr[13]
+			cyc_ep   = bus_cyc &  sel_ep
+			cyc_core = bus_cyc & ~sel_ep
+
+		if registered_decode:
+				# Costs a cycle of latency but cuts the path from the bus.
+				# Gated by the ack so a cycle isn't seen twice.
+			self.sync.sys += [
+				b_cyc_ep.eq(cyc_ep & ~b_ack_ep),
+				b_cyc_core.eq(cyc_core & ~b_ack_core),
+			]
+		else:
+			self.comb += [
+				b_cyc_ep.eq(cyc_ep),
+				b_cyc_core.eq(cyc_core),
+			]
 
-		if width > 16:
-			self.comb += b_rdata_core[16:width].eq(0)
+			# Ack / Data (the read data mux select is the registered EP ack)
+		if split_bus:
+			self.comb += [
+				bus_ep.ack.eq(b_ack_ep),
+				bus_ep.dat_r.eq(b_rdata_ep),
+				bus_core.ack.eq(b_ack_core),
+				bus_core.dat_r.eq(b_rdata_core),	# zero-extended
+			]
 
-	def gen_microcode(self):
-		# Load the microcode compiler as module
-		mod_spec = importlib.util.spec_from_file_location(
-			'no2migen.no2usb_microcode',
-			pkg_resources.resource_filename('no2migen', 'cores/no2usb/utils/microcode.py')
-		)
-		no2usb_microcode = importlib.util.module_from_spec(mod_spec)
-		mod_spec.loader.exec_module(no2usb_microcode)
+		else:
+			self.comb += [
+				self.bus.ack.eq(b_ack_core | b_ack_ep),
+				self.bus.dat_r.eq(Mux(b_ack_ep, b_rdata_ep, b_rdata_core)),	# core data is zero-extended
+			]
 
-		# Assemble microcode and return it
-		return no2usb_microcode.assemble(no2usb_microcode.mc)[0]
+	def gen_microcode(self):
+		return _assemble_microcode()
 
 	def add_gateware_dir_files(self, gateware_dir):
-		os.makedirs(os.path.realpath(gateware_dir), exist_ok=True)
-		with open(os.path.join(gateware_dir, 'usb_trans_mc.hex'), 'w') as fh:
-			for v in self.gen_microcode():
-				fh.write(f'{v:04x}\n')
+		os.makedirs(gateware_dir, exist_ok=True)
+
+		mc_path = os.path.join(gateware_dir, 'usb_trans_mc.hex')
+		mc_data = _microcode_hex()
+
+		# Leave the file (and its mtime) alone if it's already up to date
+		try:
+			with open(mc_path, 'rb') as fh:
+				if fh.read() == mc_data:
+					return
+		except FileNotFoundError:
+			pass
+
+		# Write to a temporary file and atomically move it in place
+		tmp_path = mc_path + '.tmp'
+		try:
+			with open(tmp_path, 'wb') as fh:
+				fh.write(mc_data)
+			os.replace(tmp_path, mc_path)
+		except BaseException:
+			try:
+				os.unlink(tmp_path)
+			except OSError:
+				pass
+			raise
 
 
 class NitroMuAcmCore(Module):
@@ -277,42 +394,7 @@ class NitroMuAcmCore(Module):
 		)
 
 	def gen_customized_ip(self, **kwargs):
-		# Load the customizer as module
-		mod_spec = importlib.util.spec_from_file_location(
-			'no2migen.no2muacm_customize',
-			pkg_resources.resource_filename('no2migen', 'cores/no2muacm-bin/muacm_customize.py')
-		)
-		no2muacm_customize = importlib.util.module_from_spec(mod_spec)
-		mod_spec.loader.exec_module(no2muacm_customize)
-
-		# Load source
-		sf = no2muacm_customize.MuAcmPatcher()
-		sf.load(pkg_resources.resource_filename('no2migen', 'cores/no2muacm-bin/muacm.v'))
-
-		# Apply requested customization
-		if kwargs.get('vid') is not None:
-			sf.set_vid(kwargs['vid'])
-
-		if kwargs.get('pid') is not None:
-			sf.set_pid(kwargs['pid'])
-
-		if kwargs.get('vendor') is not None:
-			sf.set_vendor(kwargs['vendor'])
-
-		if kwargs.get('product') is not None:
-			sf.set_product(kwargs['product'])
-
-		if kwargs.get('serial') is not None:
-			sf.set_serial(kwargs['serial'])
-
-		if bool(kwargs.get('no_dfu_rt')) is True:
-			sf.disable_dfu_rt()
-
-		# Save to temporary file
-		self.ip_file = tempfile.NamedTemporaryFile(suffix='.v')
-		sf.save(self.ip_file.name)
-
-		return self.ip_file.name
+		return _muacm.gen_customized_ip(**kwargs)
 
 
 class NitroMuAcmXClk(Module):
@@ -336,13 +418,9 @@ class NitroMuAcmXClk(Module):
 		self.source = source = stream.Endpoint([("data", 8)])
 
 		# Signals
-		send_snk      = Signal()
-		send_sync_src = Signal(2)
+		busy_snk = Signal()
 
-		ack_src       = Signal()
-		ack_sync_snk  = Signal(2)
-
-		# Data is straight across
+		# Data is straight across (the sink holds it until it's acked)
 		self.comb += [
 			source.data.eq  (sink.data),
 			source.first.eq (sink.first),
@@ -350,18 +428,33 @@ class NitroMuAcmXClk(Module):
 		]
 
 		# Handshaking
+			# Request / Ack pulses across domains
+		self.submodules.ps_req = ps_req = PulseSynchronizer("sink", "source")
+		self.submodules.ps_ack = ps_ack = PulseSynchronizer("source", "sink")
+
+			# Sink side: send request and wait for ack
+		self.comb += [
+			ps_req.i.eq(sink.valid & ~busy_snk),
+			sink.ready.eq(ps_ack.o),
+		]
+
 		self.sync.sink += [
-			send_snk.eq( (send_snk | (sink.valid & ~sink.ready) ) & ~ack_sync_snk[0] ),
-			ack_sync_snk[1].eq( ack_sync_snk[0] ),
-			ack_sync_snk[0].eq( ack_src ),
-			sink.ready.eq( ack_sync_snk[0] & ~ack_sync_snk[1] ),
+			If(ps_req.i,
+				busy_snk.eq(1),
+			).Elif(ps_ack.o,
+				busy_snk.eq(0),
+			)
 		]
 
+			# Source side: present data until accepted, then ack
+		self.comb += ps_ack.i.eq(source.valid & source.ready)
+
 		self.sync.source += [
-			send_sync_src[1].eq( send_sync_src[0] ),
-			send_sync_src[0].eq( send_snk ),
-			source.valid.eq( (source.valid & ~source.ready) | (send_sync_src[0] & ~send_sync_src[1]) ),
-			ack_src.eq( (ack_src & send_sync_src[0]) | (source.valid & source.ready) ),
+			If(ps_req.o,
+				source.valid.eq(1),
+			).Elif(source.ready,
+				source.valid.eq(0),
+			)
 		]
 
 
@@ -382,7 +475,7 @@ class NitroMuAcmUart(UART):
 
 	def __init__(self, platform, pads, sync=False, **kwargs):
 		assert kwargs.get("phy", None) == None
-		ckw = dict([(k,kwargs.pop(k)) for k in ['vid', 'pid', 'vendor', 'product', 'serial', 'no_dfu_rt'] if k in kwargs])
+		ckw = dict([(k,kwargs.pop(k)) for k in _muacm.OPTIONS if k in kwargs])
 		UART.__init__(self, **kwargs)
 
 		self.bootloader_req = Signal()
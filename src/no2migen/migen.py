@@ -7,15 +7,14 @@
 # SPDX-License-Identifier: CERN-OHL-P-2.0
 #
 
-import importlib
 import os
-import pkg_resources
-import tempfile
 
 from migen import *
 from migen.genlib.cdc import MultiReg, PulseSynchronizer
 from migen.genlib.fifo import SyncFIFOBuffered
 
+from . import _muacm
+
 
 __all__ = [ 'NitroMuAcmSync', 'NitroMuAcmAsync', 'NitroMuAcmBuffered' ]
 
@@ -71,8 +70,10 @@ class NitroMuAcmSync(Module):
 
 		# Add source and core instance
 		ip_path = self.gen_customized_ip(**kwargs)
-		ip_path = os.path.relpath(ip_path)	# Work around migen's stupidity
-		print(ip_path)
+		try:
+			ip_path = os.path.relpath(ip_path)	# Work around migen's stupidity
+		except ValueError:
+			pass	# No relative path possible (different drive on Windows)
 		platform.add_source(ip_path, language='verilog')
 
 		self.specials += Instance("muacm",
@@ -95,43 +96,7 @@ class NitroMuAcmSync(Module):
 		)
 
 	def gen_customized_ip(self, **kwargs):
-		# Load the customizer as module
-		mod_spec = importlib.util.spec_from_file_location(
-			'no2migen.no2muacm_customize',
-			pkg_resources.resource_filename('no2migen', 'cores/no2muacm-bin/muacm_customize.py')
-		)
-		no2muacm_customize = importlib.util.module_from_spec(mod_spec)
-		mod_spec.loader.exec_module(no2muacm_customize)
-
-		# Load source
-		sf = no2muacm_customize.MuAcmPatcher()
-		sf.load(pkg_resources.resource_filename('no2migen', 'cores/no2muacm-bin/muacm.v'))
-
-		# Apply requested customization
-		if kwargs.get('vid') is not None:
-			sf.set_vid(kwargs['vid'])
-
-		if kwargs.get('pid') is not None:
-			sf.set_pid(kwargs['pid'])
-
-		if kwargs.get('vendor') is not None:
-			sf.set_vendor(kwargs['vendor'])
-
-		if kwargs.get('product') is not None:
-			sf.set_product(kwargs['product'])
-
-		if kwargs.get('serial') is not None:
-			sf.set_serial(kwargs['serial'])
-
-		if bool(kwargs.get('no_dfu_rt')) is True:
-			sf.disable_dfu_rt()
-
-		# Save to temporary file
-		self.ip_file = tempfile.NamedTemporaryFile(suffix='.v')
-		ip_file_name = os.path.abspath(self.ip_file.name)
-		sf.save(ip_file_name)
-
-		return ip_file_name
+		return _muacm.gen_customized_ip(**kwargs)
 
 
 class NitroMuAcmXClk(Module):
@@ -168,31 +133,42 @@ class NitroMuAcmXClk(Module):
 		self.out_ready = Signal()
 
 		# Internal signals
-		send_in        = Signal()
-		send_sync_out  = Signal(2)
+		busy_in = Signal()
 
-		ack_out        = Signal()
-		ack_sync_in    = Signal(2)
-
-		# Data is straight across
+		# Data is straight across (the ingress holds it until it's acked)
 		self.comb += [
 			self.out_data.eq  (self.in_data),
 			self.out_last.eq  (self.in_last),
 		]
 
 		# Handshaking
+			# Request / Ack pulses across domains
+		self.submodules.ps_req = ps_req = PulseSynchronizer("in_", "out")
+		self.submodules.ps_ack = ps_ack = PulseSynchronizer("out", "in_")
+
+			# Ingress side: send request and wait for ack
+		self.comb += [
+			ps_req.i.eq(self.in_valid & ~busy_in),
+			self.in_ready.eq(ps_ack.o),
+		]
+
 		self.sync.in_ += [
-			send_in.eq( (send_in | (self.in_valid & ~self.in_ready) ) & ~ack_sync_in[0] ),
-			ack_sync_in[1].eq( ack_sync_in[0] ),
-			ack_sync_in[0].eq( ack_out ),
-			self.in_ready.eq( ack_sync_in[0] & ~ack_sync_in[1] ),
+			If(ps_req.i,
+				busy_in.eq(1),
+			).Elif(ps_ack.o,
+				busy_in.eq(0),
+			)
 		]
 
+			# Egress side: present data until accepted, then ack
+		self.comb += ps_ack.i.eq(self.out_valid & self.out_ready)
+
 		self.sync.out += [
-			send_sync_out[1].eq( send_sync_out[0] ),
-			send_sync_out[0].eq( send_in ),
-			self.out_valid.eq( (self.out_valid & ~self.out_ready) | (send_sync_out[0] & ~send_sync_out[1]) ),
-			ack_out.eq( (ack_out & send_sync_out[0]) | (self.out_valid & self.out_ready) ),
+			If(ps_req.o,
+				self.out_valid.eq(1),
+			).Elif(self.out_ready,
+				self.out_valid.eq(0),
+			)
 		]
 
 